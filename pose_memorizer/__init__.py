@@ -5,14 +5,29 @@
 # - Maya 2020.2
 # -----------------------------------------------------------------------------
 
+import sys
+import time
+
 _name = "PoseMemorizer"
 _config_dir = "pose_memorizer"
-_version = "0.2.0"
+_version = "0.3.0"
+
+# Set True to print open/restore times to the Script Editor
+report_time = False
 
 # -----------------------------------------------------------------------------
+def _report_time(label, start):
+    if report_time is True:
+        print("# {}: {} {:.3f} sec".format(_name, label, time.time() - start))
+    return
+
+
 def run():
+    start = time.time()
+    cold = "pose_memorizer.gui" not in sys.modules
     from pose_memorizer import gui as pomezer_gui
     pomezer_gui.main()
+    _report_time("cold open" if cold else "reopen", start)
     return
 
 # -----------------------------------------------------------------------------
@@ -3,6 +3,8 @@
 # PoseMemorizer Core (Maya2018-)
 # -----------------------------------------------------------------------------
 
+import re
+from array import array
 from math import degrees
 from math import radians
 
@@ -11,6 +13,156 @@ from maya import mel
 from maya.api import OpenMaya as om2
 
 
+# -----------------------------------------------------------------------------
+
+CHANNEL_SCALE = "scale"
+CHANNEL_USER = "user"
+CHANNEL_BLENDSHAPE = "blendShape"
+CHANNELS = (CHANNEL_SCALE, CHANNEL_USER, CHANNEL_BLENDSHAPE)
+
+SCALE_ATTRS = ("scaleX", "scaleY", "scaleZ")
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+class Pose(object):
+    """Memorized pose.
+
+    Translate/Rotate are kept per transform node in ``transform``.
+    Scale, user attribute and blendShape weight channels are kept
+    column-wise: ``index`` (node table index), ``attrs`` and ``values``
+    share the same order, ``values`` being a typed double array.
+    """
+
+    def __init__(self, channels=()):
+        super(Pose, self).__init__()
+        self.channels = tuple(channels)
+        self.nodes = []
+        self.transform = {}
+        self.index = array("I")
+        self.attrs = []
+        self.values = array("d")
+        self._node_index = {}
+        return
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _get_node_index(self, node):
+        index = self._node_index.get(node)
+        if index is None:
+            index = len(self.nodes)
+            self._node_index[node] = index
+            self.nodes.append(node)
+        return index
+
+    def add_node(self, node):
+        self._get_node_index(node)
+        return
+
+    def set_transform(self, node, parameter):
+        self._get_node_index(node)
+        self.transform[node] = parameter
+        return
+
+    def add_channel(self, node, attr, value):
+        self.index.append(self._get_node_index(node))
+        self.attrs.append(attr)
+        self.values.append(value)
+        return
+
+    def iter_channels(self):
+        nodes = self.nodes
+        for i, a, v in zip(self.index, self.attrs, self.values):
+            yield nodes[i], a, v
+
+    def to_data(self):
+        transform = {}
+        for n, p in self.transform.items():
+            rotate = p["rotate"]
+            transform[n] = {"translate": list(p["translate"]),
+                            "rotate": [rotate.x, rotate.y, rotate.z, rotate.w]}
+        return {"channels": list(self.channels),
+                "nodes": list(self.nodes),
+                "transform": transform,
+                "index": self.index.tolist(),
+                "attrs": list(self.attrs),
+                "values": self.values.tolist()}
+
+    @classmethod
+    def from_data(cls, data):
+        pose = cls(data.get("channels", ()))
+        nodes = data.get("nodes", [])
+        transform = data.get("transform", {})
+        for n in nodes:
+            p = transform.get(n)
+            if p is None:
+                pose.add_node(n)
+            else:
+                pose.set_transform(n, {"translate": tuple(p["translate"]),
+                                       "rotate": om2.MQuaternion(p["rotate"])})
+        for i, a, v in zip(data.get("index", []), data.get("attrs", []),
+                           data.get("values", [])):
+            pose.add_channel(nodes[i], a, v)
+        return pose
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+class PosePreview(object):
+    """Temporary pose display.
+
+    Values are precomputed in internal units and pushed straight to the
+    plugs, so nothing goes to the undo queue. ``end`` puts back the values
+    read at ``begin``, but only on plugs still holding the preview value,
+    so a change made meanwhile (undo, time change, script) is not
+    overwritten. The plug nodes are tracked with MObjectHandle, a preview
+    whose nodes were deleted (delete, undo, file open) is never written.
+    """
+
+    def __init__(self, plugs, values):
+        super(PosePreview, self).__init__()
+        self.plugs = plugs
+        self.values = values
+        self._handles = [om2.MObjectHandle(p.node()) for p in plugs]
+        self._restore_values = None
+        self._preview_values = None
+        return
+
+    def is_active(self):
+        return self._restore_values is not None
+
+    def is_valid(self):
+        return all(h.isValid() for h in self._handles)
+
+    def begin(self):
+        if self.is_active() is True or self.is_valid() is False:
+            return
+        plugs = self.plugs
+        self._restore_values = array("d", [p.asDouble() for p in plugs])
+        for p, v in zip(plugs, self.values):
+            p.setDouble(v)
+        # read back, float attributes do not keep the double exactly
+        self._preview_values = array("d", [p.asDouble() for p in plugs])
+        cmds.refresh(currentView=True)
+        return
+
+    def end(self, refresh=True):
+        # refresh=False when another preview begins right after,
+        # so a hover from item to item redraws once
+        if self.is_active() is False:
+            return
+        for p, h, pv, v in zip(self.plugs, self._handles,
+                               self._preview_values, self._restore_values):
+            if h.isValid() is True and p.asDouble() == pv:
+                p.setDouble(v)
+        self._restore_values = None
+        self._preview_values = None
+        if refresh is True:
+            cmds.refresh(currentView=True)
+        return
+
+
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
 class PoseMemorizer(object):
@@ -33,7 +185,92 @@ class PoseMemorizer(object):
         z_qua = (1, 1, -1, -1)
         return {"x": (x_trans, x_qua), "y": (y_trans, y_qua), "z": (z_trans, z_qua)}
 
-    def _make_pose_parameter(self, nodes):
+    def _get_plug_value(self, plug):
+        # MEL setAttr/setKeyframe expect UI units
+        attr = plug.attribute()
+        if attr.hasFn(om2.MFn.kUnitAttribute) is True:
+            unit_type = om2.MFnUnitAttribute(attr).unitType()
+            if unit_type == om2.MFnUnitAttribute.kAngle:
+                return plug.asMAngle().asUnits(om2.MAngle.uiUnit())
+            if unit_type == om2.MFnUnitAttribute.kDistance:
+                return plug.asMDistance().asUnits(om2.MDistance.uiUnit())
+        return plug.asDouble()
+
+    def _get_internal_value(self, plug, value):
+        # inverse of _get_plug_value
+        attr = plug.attribute()
+        if attr.hasFn(om2.MFn.kUnitAttribute) is True:
+            unit_type = om2.MFnUnitAttribute(attr).unitType()
+            if unit_type == om2.MFnUnitAttribute.kAngle:
+                return om2.MAngle(value, om2.MAngle.uiUnit()).asRadians()
+            if unit_type == om2.MFnUnitAttribute.kDistance:
+                return om2.MDistance(value, om2.MDistance.uiUnit()).asCentimeters()
+        return value
+
+    def _get_fn_node(self, node):
+        sel = om2.MSelectionList()
+        sel.add(node)
+        return om2.MFnDependencyNode(sel.getDependNode(0))
+
+    def _get_attr_plug(self, node_cache, node, attr):
+        # node_cache : {node: (MFnDependencyNode, {alias: attr})}
+        item = node_cache.get(node)
+        if item is None:
+            fn_node = self._get_fn_node(node)
+            item = (fn_node, dict(fn_node.getAliasList()))
+            node_cache[node] = item
+        fn_node, aliases = item
+        attr = aliases.get(attr, attr)
+        match = re.match(r"^(\w+)\[(\d+)\]$", attr)
+        try:
+            if match is not None:
+                plug = fn_node.findPlug(match.group(1), False)
+                return plug.elementByLogicalIndex(int(match.group(2)))
+            return fn_node.findPlug(attr, False)
+        except RuntimeError:
+            return None
+
+    def _get_blendshapes(self, nodes):
+        blendshapes = cmds.ls(nodes, type="blendShape") or []
+        transforms = cmds.ls(nodes, transforms=True) or []
+        if len(transforms) > 0:
+            history = cmds.listHistory(transforms, pruneDagObjects=True) or []
+            blendshapes.extend(cmds.ls(history, type="blendShape") or [])
+        reslut = []
+        for b in blendshapes:
+            if b not in reslut:
+                reslut.append(b)
+        return reslut
+
+    def _make_channel_parameter(self, pose, transforms, blendshapes):
+        channels = pose.channels
+        get_value = self._get_plug_value
+
+        for n in transforms:
+            if CHANNEL_SCALE in channels:
+                scale = cmds.getAttr("{}.scale".format(n))[0]
+                for a, v in zip(SCALE_ATTRS, scale):
+                    pose.add_channel(n, a, v)
+            if CHANNEL_USER in channels:
+                # no bulk read for arbitrary dynamic attributes, one plug each
+                attrs = cmds.listAttr(n, userDefined=True, keyable=True, scalar=True) or []
+                if len(attrs) > 0:
+                    fn_node = self._get_fn_node(n)
+                    for a in attrs:
+                        pose.add_channel(n, a, get_value(fn_node.findPlug(a, False)))
+
+        for n in blendshapes:
+            fn_node = self._get_fn_node(n)
+            aliases = {p: a for a, p in fn_node.getAliasList()}
+            weight = fn_node.findPlug("weight", False)
+            # walk the existing elements of the weight array once
+            for i in range(weight.numElements()):
+                plug = weight.elementByPhysicalIndex(i)
+                name = "weight[{}]".format(plug.logicalIndex())
+                pose.add_channel(n, aliases.get(name, name), plug.asDouble())
+        return
+
+    def _make_pose_parameter(self, nodes, channels=()):
 
         def get_transform(node):
             return cmds.getAttr("{}.translate".format(node))[0]
@@ -48,41 +285,102 @@ class PoseMemorizer(object):
                 orient = conv_qua(cmds.getAttr("{}.jointOrient".format(node))[0], order)
             return axis * rotate * orient
 
-        return {n: {"translate": get_transform(n), "rotate": get_quaternion(n)}
-                for n in nodes}
+        pose = Pose(channels)
+        transforms = cmds.ls(nodes, transforms=True) or []
+        for n in transforms:
+            pose.set_transform(n, {"translate": get_transform(n), "rotate": get_quaternion(n)})
+
+        blendshapes = []
+        if CHANNEL_BLENDSHAPE in channels:
+            blendshapes = self._get_blendshapes(nodes)
+            for b in blendshapes:
+                pose.add_node(b)
+
+        self._make_channel_parameter(pose, transforms, blendshapes)
+        return pose
+
+    def _swap_attr_name(self, name, left, right):
+        # Only whole tokens are swapped ("smile_L", "lip_L_up", "browLeft"),
+        # so "brow_raise" or "lip_lower" are left as they are.
+        # Also used for node names.
+
+        def pattern(token):
+            prefix = "(?<![a-z])" if token[0].islower() is True else ""
+            return "({}{}(?![a-z]))".format(prefix, re.escape(token))
+
+        def swap(match):
+            return right if match.group(1) is not None else left
+
+        regex = re.compile("|".join([pattern(left), pattern(right)]))
+        return regex.sub(swap, name)
 
     def _convert_target_pose(self, pose, mirror, mirror_name, namespace):
 
         def basename(name):
             return name.split(":")[-1]
 
+        def swap_name(name):
+            if left in name:
+                return name.replace(left, right)
+            elif right in name:
+                return name.replace(right, left)
+            return name
+
         if mirror is True:
             split_name = mirror_name.split(" : ")
             left = split_name[0]
             right = split_name[1]
-            change_pose = {}
-            for n, m in pose.items():
-                if left in n:
-                    change_pose[n.replace(left, right)] = m
-                elif right in n:
-                    change_pose[n.replace(right, left)] = m
-                else:
-                    change_pose[n] = m
-            pose = change_pose
 
-        target_pose = {}
+        sel_nodes = self._get_sel_nodes(pose.channels)
         if namespace is True:
-            sel_trans = set(self._get_sel_transform())
-            target_pose = {n: m for n, m in pose.items() if n in sel_trans}
+            sel_map = {n: n for n in sel_nodes}
         else:
-            sel_trans = {basename(t): t for t in self._get_sel_transform()}
-            target_pose = {sel_trans.get(basename(n)): m for n, m in pose.items()
-                           if sel_trans.get(basename(n)) is not None}
+            sel_map = {basename(n): n for n in sel_nodes}
+
+        def target_name(name):
+            if namespace is False:
+                name = basename(name)
+            return sel_map.get(name)
+
+        target_nodes = []
+        for n in pose.nodes:
+            if mirror is True:
+                # token swap first, "face_lips_bs" must not become
+                # "face_rips_bs" with "_l : _r", then the plain swap
+                target = target_name(self._swap_attr_name(n, left, right))
+                if target is None:
+                    target = target_name(swap_name(n))
+            else:
+                target = target_name(n)
+            target_nodes.append(target)
+
+        node_cache = {}
+        target_pose = Pose(pose.channels)
+        for n, m in zip(pose.nodes, target_nodes):
+            if m is not None and n in pose.transform:
+                target_pose.set_transform(m, pose.transform[n])
+
+        for i, a, v in zip(pose.index, pose.attrs, pose.values):
+            target = target_nodes[i]
+            if target is None:
+                continue
+            if mirror is True:
+                swap_attr = self._swap_attr_name(a, left, right)
+                # keep the name if the mirrored attribute does not exist
+                if swap_attr != a and self._get_attr_plug(node_cache, target, swap_attr) is not None:
+                    a = swap_attr
+            target_pose.add_channel(target, a, v)
         return target_pose
 
     def _get_sel_transform(self):
         return cmds.ls(selection=True, transforms=True)
 
+    def _get_sel_nodes(self, channels=()):
+        nodes = self._get_sel_transform()
+        if CHANNEL_BLENDSHAPE in channels:
+            nodes = nodes + self._get_blendshapes(cmds.ls(selection=True))
+        return nodes
+
     def _get_mirror_matrix(self, mirror_axis):
         return self.mirror_matrix.get(mirror_axis.lower())
 
@@ -184,22 +482,89 @@ class PoseMemorizer(object):
         reslut_add("dgdirty {}".format(nodes))
         return ";".join(reslut)
 
-    def get_pose(self, transform=[]):
-        if len(transform) == 0:
-            transform = self._get_sel_transform()
-        return self._make_pose_parameter(transform)
+    def _is_settable(self, plug):
+        if plug.isLocked is True:
+            return False
+        if plug.isDestination is True:
+            return plug.source().node().hasFn(om2.MFn.kAnimCurve)
+        return True
+
+    def _get_channel_plugs(self, pose):
+        """Resolve the settable channel plugs of pose.
+
+        Returns (plug names, MPlugs, values), values in UI units.
+        """
+        node_cache = {}
+        names = []
+        plugs = []
+        values = array("d")
+        for n, a, v in pose.iter_channels():
+            plug = self._get_attr_plug(node_cache, n, a)
+            if plug is None or self._is_settable(plug) is False:
+                continue
+            names.append("{}.{}".format(n, a))
+            plugs.append(plug)
+            values.append(v)
+        return names, plugs, values
+
+    def _set_channel_values(self, names, values, setkey):
+        # cmds keeps Apply undoable, MPlug writes would bypass the undo queue
+        if setkey is True:
+            for n, v in zip(names, values):
+                cmds.setKeyframe(n, value=v, dirtyDG=True)
+        else:
+            for n, v in zip(names, values):
+                cmds.setAttr(n, v)
+        return
+
+    def get_pose(self, nodes=[], channels=()):
+        if len(nodes) == 0:
+            nodes = self._get_sel_nodes(channels)
+        return self._make_pose_parameter(nodes, channels)
+
+    def make_preview(self, pose, mirror, mirror_name, mirror_axis, namespace):
+        target_pose = self._convert_target_pose(pose, mirror, mirror_name, namespace)
+        pose_tr = self._get_translate_rotate(target_pose.transform, mirror, mirror_axis)
+        is_settable = self._is_settable
+
+        plugs = []
+        values = array("d")
+
+        for n, m in pose_tr.items():
+            translate, rotate = m
+            fn_node = self._get_fn_node(n)
+            for a, v in zip(("translateX", "translateY", "translateZ"), translate):
+                plug = fn_node.findPlug(a, False)
+                if is_settable(plug) is True:
+                    plugs.append(plug)
+                    values.append(self._get_internal_value(plug, v))
+            for a, v in zip(("rotateX", "rotateY", "rotateZ"), rotate):
+                plug = fn_node.findPlug(a, False)
+                if is_settable(plug) is True:
+                    plugs.append(plug)
+                    values.append(radians(v))
+
+        _, channel_plugs, channel_values = self._get_channel_plugs(target_pose)
+        for plug, v in zip(channel_plugs, channel_values):
+            plugs.append(plug)
+            values.append(self._get_internal_value(plug, v))
+
+        return PosePreview(plugs, values)
 
     def apply_pose(self, pose, mirror, mirror_name, mirror_axis, setkey, namespace):
         cmds.refresh(suspend=True)
         try:
             target_pose = self._convert_target_pose(pose, mirror, mirror_name, namespace)
-            pose_tr = self._get_translate_rotate(target_pose, mirror, mirror_axis)
-            cmd = ""
-            if setkey is True:
-                cmd = self._get_setkey_command(pose_tr)
-            else:
-                cmd = self._get_setattr_command(pose_tr)
-            mel.eval(cmd)
+            pose_tr = self._get_translate_rotate(target_pose.transform, mirror, mirror_axis)
+            if len(pose_tr) > 0:
+                cmd = ""
+                if setkey is True:
+                    cmd = self._get_setkey_command(pose_tr)
+                else:
+                    cmd = self._get_setattr_command(pose_tr)
+                mel.eval(cmd)
+            names, _, values = self._get_channel_plugs(target_pose)
+            self._set_channel_values(names, values, setkey)
         finally:
             cmds.refresh(suspend=False)
             cmds.refresh(currentView=True)
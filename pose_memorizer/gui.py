@@ -4,6 +4,7 @@
 # -----------------------------------------------------------------------------
 
 import os
+import time
 import traceback
 import json
 import functools
@@ -49,6 +50,59 @@ class Callback(object):
             cmds.undoInfo(closeChunk=True)
 
 
+# -----------------------------------------------------------------------------
+def kill_script_jobs(job_ids, *args):
+    for job_id in job_ids:
+        if cmds.scriptJob(exists=job_id) is True:
+            cmds.scriptJob(kill=job_id, force=True)
+    del job_ids[:]
+    return
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+class PoseStore(object):
+    """Memorized poses of the Maya session.
+
+    Lives at module level so rebuilding the dock widget (scene or
+    workspace restore, reopening the tool) keeps the pose list.
+    Rows match the rows of PoseListWidget.
+    """
+
+    def __init__(self):
+        super(PoseStore, self).__init__()
+        self.poses = []
+        return
+
+    def __len__(self):
+        return len(self.poses)
+
+    def __iter__(self):
+        return iter(self.poses)
+
+    def add(self, name, pose):
+        self.poses.append([name, pose])
+        return
+
+    def rename(self, row, name):
+        if 0 <= row < len(self.poses):
+            self.poses[row][0] = name
+        return
+
+    def update(self, row, pose):
+        if 0 <= row < len(self.poses):
+            self.poses[row][1] = pose
+        return
+
+    def remove(self, row):
+        if 0 <= row < len(self.poses):
+            del self.poses[row]
+        return
+
+
+POSE_STORE = PoseStore()
+
+
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
 class OptionFile(object):
@@ -60,6 +114,7 @@ class OptionFile(object):
         self.version = pomezer._version
         self.parameter = {}
         self._file_path = self._get_file_path()
+        self._is_newer_file = False
         return
 
     def unify_sep(func):
@@ -101,17 +156,55 @@ class OptionFile(object):
         self.parameter = parameter
         return
 
+    def _parse_version(self, version):
+        try:
+            return tuple(int(v) for v in version.split("."))
+        except (AttributeError, ValueError):
+            return None
+
+    def _migrate_0_2_0(self, data):
+        # 0.3.0 : channel sets, preview
+        for key in ("scale", "user_attr", "blendshape", "preview"):
+            data.setdefault(key, False)
+        return data
+
+    # {file version: (next version, function(self, data) -> data)}
+    MIGRATIONS = {
+        "0.2.0": ("0.3.0", _migrate_0_2_0),
+    }
+
+    def _migrate(self, data, version):
+        while version != self.version:
+            step = self.MIGRATIONS.get(version)
+            if step is None:
+                return None
+            version, migrate = step
+            data = migrate(self, data)
+        data["version"] = version
+        return data
+
     def load(self):
         data = {}
+        if os.path.exists(self._file_path) is False:
+            return None
         with open(self._file_path, "r") as f:
             data = json.load(f)
         file_version = data.get("version", None)
-        if file_version != self.version:
-            return None
+        if file_version == self.version:
+            return data
 
-        return data
+        parsed_version = self._parse_version(file_version)
+        if parsed_version is None:
+            return None
+        # options of a newer tool are not read, nor overwritten on save
+        if parsed_version > self._parse_version(self.version):
+            self._is_newer_file = True
+            return None
+        return self._migrate(data, file_version)
 
     def save(self):
+        if self._is_newer_file is True:
+            return
         data = {"version": self.version}
         data.update(self.parameter)
         self._check_file_path()
@@ -155,6 +248,7 @@ class HorizontalLine(QtWidgets.QFrame):
 class PoseListWidget(QtWidgets.QListWidget):
 
     itemRightClicked = QtCore.Signal(QtWidgets.QListWidgetItem)
+    itemHoverEnded = QtCore.Signal()
 
     def __init__(self, *args, **kwargs):
         super(PoseListWidget, self).__init__(*args, **kwargs)
@@ -164,6 +258,13 @@ class PoseListWidget(QtWidgets.QListWidget):
         self.setObjectName(("pose_list"))
         self.setUniformItemSizes(True)
         self.setFocusPolicy(QtCore.Qt.NoFocus)
+        # itemEntered
+        self.setMouseTracking(True)
+        return
+
+    def leaveEvent(self, event):
+        self.itemHoverEnded.emit()
+        super(self.__class__, self).leaveEvent(event)
         return
 
     def mousePressEvent(self, event):
@@ -179,6 +280,8 @@ class PoseListWidget(QtWidgets.QListWidget):
             if index.row() >= 0:
                 self.setSelection(self.rectForIndex(index),
                                   self.selectionCommand(index))
+        if self.indexAt(event.pos()).isValid() is False:
+            self.itemHoverEnded.emit()
         super(self.__class__, self).mouseMoveEvent(event)
         return
 
@@ -199,6 +302,10 @@ class PoseMemorizerDockableWidget(MayaQWidgetDockableMixin, ScrollWidget):
 
     MIRRORNAME = ["Left : Right", "left : right", "_L : _R", "_l : _r"]
     MIRRORAXIS = ["X", "Y", "Z"]
+    PREVIEW_CACHE_SIZE = 16
+    # scene changes which end a running preview
+    PREVIEW_END_EVENTS = ["Undo", "Redo", "timeChanged"]
+    LIBRARY_FILTER = "Pose Library (*.jsonl *.jsonl.gz)"
 
     def __init__(self, parent=None):
         super(PoseMemorizerDockableWidget, self).__init__(parent=parent)
@@ -206,6 +313,14 @@ class PoseMemorizerDockableWidget(MayaQWidgetDockableMixin, ScrollWidget):
         self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
 
         self.pomezer = pomezer_core.PoseMemorizer()
+        self.pose_store = POSE_STORE
+        self._preview = None
+        self._preview_cache = {}
+        self._preview_selection = None
+        self._script_jobs = [cmds.scriptJob(event=[e, self._scene_changed])
+                             for e in self.PREVIEW_END_EVENTS]
+        # the dock can be rebuilt without dockCloseEventTriggered
+        self.destroyed.connect(functools.partial(kill_script_jobs, self._script_jobs))
         self.op_file = OptionFile()
 
         self.widget = QtWidgets.QWidget(self)
@@ -229,6 +344,10 @@ class PoseMemorizerDockableWidget(MayaQWidgetDockableMixin, ScrollWidget):
         check_layout.setSpacing(16)
         check_layout.setContentsMargins(0, 0, 0, 0)
 
+        channel_layout = QtWidgets.QHBoxLayout(self)
+        channel_layout.setSpacing(16)
+        channel_layout.setContentsMargins(0, 0, 0, 0)
+
         # Widget
         self.memorize_button = QtWidgets.QPushButton("Memorize", self)
         memorize_button = self.memorize_button
@@ -246,6 +365,9 @@ class PoseMemorizerDockableWidget(MayaQWidgetDockableMixin, ScrollWidget):
         pose_list = self.pose_list
         pose_list.itemDoubleClicked.connect(self._edit_item_name)
         pose_list.itemRightClicked.connect(self._right_click_item)
+        pose_list.itemChanged.connect(self._rename_item)
+        pose_list.itemEntered.connect(self._hover_item)
+        pose_list.itemHoverEnded.connect(self._end_preview)
 
         self.mirror_name_combo = QtWidgets.QComboBox(self)
         mirror_name_combo = self.mirror_name_combo
@@ -259,6 +381,18 @@ class PoseMemorizerDockableWidget(MayaQWidgetDockableMixin, ScrollWidget):
         mirror_check = self.mirror_check
         mirror_check.setChecked(True)
 
+        self.scale_check = QtWidgets.QCheckBox("Scale", self)
+        scale_check = self.scale_check
+        scale_check.setChecked(False)
+
+        self.user_attr_check = QtWidgets.QCheckBox("User Attr", self)
+        user_attr_check = self.user_attr_check
+        user_attr_check.setChecked(False)
+
+        self.blendshape_check = QtWidgets.QCheckBox("BlendShape", self)
+        blendshape_check = self.blendshape_check
+        blendshape_check.setChecked(False)
+
         self.setkey_check = QtWidgets.QCheckBox("Set Key", self)
         setkey_check = self.setkey_check
         setkey_check.setChecked(False)
@@ -269,11 +403,30 @@ class PoseMemorizerDockableWidget(MayaQWidgetDockableMixin, ScrollWidget):
         namespace_check.setChecked(True)
         # namespace_check.setFixedHeight(28)
 
+        self.preview_check = QtWidgets.QCheckBox("Preview", self)
+        preview_check = self.preview_check
+        preview_check.setChecked(False)
+        preview_check.toggled.connect(self._toggle_preview)
+
         self.apply_button = QtWidgets.QPushButton("Apply", self)
         apply_button = self.apply_button
         apply_button.clicked.connect(Callback(self._click_apply))
         apply_button.setFixedHeight(28)
 
+        self.import_button = QtWidgets.QPushButton("Import", self)
+        import_button = self.import_button
+        import_button.clicked.connect(self._click_import)
+
+        self.export_button = QtWidgets.QPushButton("Export", self)
+        export_button = self.export_button
+        export_button.clicked.connect(self._click_export)
+
+        library_layout = QtWidgets.QHBoxLayout(self)
+        library_layout.setSpacing(4)
+        library_layout.setContentsMargins(0, 0, 0, 0)
+        library_layout.addWidget(import_button)
+        library_layout.addWidget(export_button)
+
         button_layout.addWidget(memorize_button, 3)
         button_layout.addWidget(update_button, 2)
         button_layout.addWidget(delete_button, 1)
@@ -283,8 +436,14 @@ class PoseMemorizerDockableWidget(MayaQWidgetDockableMixin, ScrollWidget):
 
         check_layout.addWidget(setkey_check)
         check_layout.addWidget(namespace_check)
+        check_layout.addWidget(preview_check)
+
+        channel_layout.addWidget(scale_check)
+        channel_layout.addWidget(user_attr_check)
+        channel_layout.addWidget(blendshape_check)
 
         layout.addLayout(button_layout)
+        layout.addLayout(channel_layout)
         layout.addWidget(pose_list)
         layout.addWidget(mirror_name_combo)
         layout.addLayout(mirror_layout)
@@ -292,28 +451,49 @@ class PoseMemorizerDockableWidget(MayaQWidgetDockableMixin, ScrollWidget):
         layout.addLayout(check_layout)
         layout.addWidget(HorizontalLine())
         layout.addWidget(apply_button)
+        layout.addWidget(HorizontalLine())
+        layout.addLayout(library_layout)
 
         widget.setLayout(layout)
         self.setWidget(widget)
 
         self._option_load()
+        self._restore_poses()
         QtWidgets.qApp.aboutToQuit.connect(self._option_save, QtCore.Qt.UniqueConnection)
         return
 
     def dockCloseEventTriggered(self):
+        self._end_preview()
+        kill_script_jobs(self._script_jobs)
         self._option_save()
         return
 
-    def _add_pose(self, pose_data):
-        name = pose_data.keys()[0]
+    def _add_item(self, name, pose_data):
         item = QtWidgets.QListWidgetItem()
         item.setData(QtCore.Qt.DisplayRole, name)
         item.setData(QtCore.Qt.UserRole + 1, pose_data)
         item.setFlags(item.flags() | QtCore.Qt.ItemIsEditable)
         self.pose_list.addItem(item)
+        return
+
+    def _add_pose(self, pose_data, name=None):
+        if name is None:
+            name = pose_data.nodes[0]
+        self.pose_store.add(name, pose_data)
+        self._add_item(name, pose_data)
         self.pose_list.clearSelection()
         return
 
+    def _restore_poses(self):
+        pose_list = self.pose_list
+        pose_list.setUpdatesEnabled(False)
+        try:
+            for name, pose_data in self.pose_store:
+                self._add_item(name, pose_data)
+        finally:
+            pose_list.setUpdatesEnabled(True)
+        return
+
     def _get_ui_parameter(self):
         reslut = {}
         reslut["mirror_name"] = self.mirror_name_combo.currentText()
@@ -321,6 +501,20 @@ class PoseMemorizerDockableWidget(MayaQWidgetDockableMixin, ScrollWidget):
         reslut["mirror"] = self.mirror_check.isChecked()
         reslut["setkey"] = self.setkey_check.isChecked()
         reslut["namespace"] = self.namespace_check.isChecked()
+        reslut["scale"] = self.scale_check.isChecked()
+        reslut["user_attr"] = self.user_attr_check.isChecked()
+        reslut["blendshape"] = self.blendshape_check.isChecked()
+        reslut["preview"] = self.preview_check.isChecked()
+        return reslut
+
+    def _get_channels(self):
+        reslut = []
+        if self.scale_check.isChecked() is True:
+            reslut.append(pomezer_core.CHANNEL_SCALE)
+        if self.user_attr_check.isChecked() is True:
+            reslut.append(pomezer_core.CHANNEL_USER)
+        if self.blendshape_check.isChecked() is True:
+            reslut.append(pomezer_core.CHANNEL_BLENDSHAPE)
         return reslut
 
     def _get_sel_item(self):
@@ -333,38 +527,117 @@ class PoseMemorizerDockableWidget(MayaQWidgetDockableMixin, ScrollWidget):
         self.pose_list.editItem(item)
         return
 
+    def _rename_item(self, item):
+        self.pose_store.rename(self.pose_list.row(item), item.text())
+        return
+
     def _right_click_item(self):
         item = self._get_sel_item()
         if item is None:
             return
         pose_data = item.data(QtCore.Qt.UserRole + 1)
-        cmds.select(pose_data.keys(), replace=True)
+        cmds.select(pose_data.nodes, replace=True)
+        return
+
+    def _get_preview(self, item):
+        ui_parameter = self._get_ui_parameter()
+        selection = tuple(cmds.ls(selection=True))
+        if selection != self._preview_selection:
+            self._preview_cache.clear()
+            self._preview_selection = selection
+
+        key = (self.pose_list.row(item),
+               ui_parameter["mirror"],
+               ui_parameter["mirror_name"],
+               ui_parameter["mirror_axis"],
+               ui_parameter["namespace"])
+        preview = self._preview_cache.get(key)
+        # nodes of the cached plugs may be gone (delete, undo, file open)
+        if preview is None or preview.is_valid() is False:
+            if len(self._preview_cache) >= self.PREVIEW_CACHE_SIZE:
+                self._preview_cache.clear()
+            start = time.time()
+            preview = self.pomezer.make_preview(pose=item.data(QtCore.Qt.UserRole + 1),
+                                                mirror=ui_parameter["mirror"],
+                                                mirror_name=ui_parameter["mirror_name"],
+                                                mirror_axis=ui_parameter["mirror_axis"],
+                                                namespace=ui_parameter["namespace"])
+            self._preview_cache[key] = preview
+            pomezer._report_time("preview build", start)
+        return preview
+
+    def _hover_item(self, item):
+        if self.preview_check.isChecked() is False:
+            return
+        self._end_preview(refresh=False)
+        try:
+            self._preview = self._get_preview(item)
+            start = time.time()
+            self._preview.begin()
+            pomezer._report_time("preview begin", start)
+        except:
+            traceback.print_exc()
+        # the previous preview ended without a redraw
+        if self._preview is None or self._preview.is_active() is False:
+            cmds.refresh(currentView=True)
+        return
+
+    def _end_preview(self, refresh=True):
+        if self._preview is None:
+            return
+        try:
+            self._preview.end(refresh=refresh)
+        except:
+            traceback.print_exc()
+        finally:
+            self._preview = None
+        return
+
+    def _scene_changed(self):
+        # values of the cached previews may be out of date
+        self._end_preview()
+        self._preview_cache.clear()
+        return
+
+    def _toggle_preview(self, checked):
+        if checked is False:
+            self._end_preview()
+            self._preview_cache.clear()
         return
 
     def _click_memorize(self):
-        pose_data = self.pomezer.get_pose()
+        self._end_preview()
+        pose_data = self.pomezer.get_pose(channels=self._get_channels())
         if len(pose_data) > 0:
             self._add_pose(pose_data)
         return
 
     def _click_update(self):
+        self._end_preview()
         item = self._get_sel_item()
         if item is None:
             return
-        transform = item.data(QtCore.Qt.UserRole + 1).keys()
-        pose_data = self.pomezer.get_pose(transform)
+        self._preview_cache.clear()
+        src_pose = item.data(QtCore.Qt.UserRole + 1)
+        pose_data = self.pomezer.get_pose(src_pose.nodes, src_pose.channels)
         item.setData(QtCore.Qt.UserRole + 1, pose_data)
+        self.pose_store.update(self.pose_list.row(item), pose_data)
         return
 
     def _click_delete(self):
+        self._end_preview()
         item = self._get_sel_item()
         if item is None:
             return
-        self.pose_list.takeItem(self.pose_list.row(item))
+        self._preview_cache.clear()
+        row = self.pose_list.row(item)
+        self.pose_list.takeItem(row)
+        self.pose_store.remove(row)
         del(item)
         return
 
     def _click_apply(self):
+        self._end_preview()
         item = self._get_sel_item()
         if item is None:
             return
@@ -383,15 +656,58 @@ class PoseMemorizerDockableWidget(MayaQWidgetDockableMixin, ScrollWidget):
                                 namespace=namespace)
         return
 
+    def _click_import(self):
+        self._end_preview()
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Import Poses", "",
+                                                        self.LIBRARY_FILTER)
+        if len(path) == 0:
+            return
+        import pose_memorizer.library as pomezer_library
+        pose_list = self.pose_list
+        row_count = pose_list.count()
+        pose_list.setUpdatesEnabled(False)
+        try:
+            for name, pose_data in pomezer_library.iter_poses(path):
+                self._add_pose(pomezer_core.Pose.from_data(pose_data), name)
+        except:
+            traceback.print_exc()
+            # no partial import
+            for row in reversed(range(row_count, pose_list.count())):
+                pose_list.takeItem(row)
+                self.pose_store.remove(row)
+            cmds.warning("{}: Failed to import {}".format(pomezer._name, path))
+        finally:
+            pose_list.setUpdatesEnabled(True)
+        return
+
+    def _click_export(self):
+        self._end_preview()
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export Poses", "",
+                                                        self.LIBRARY_FILTER)
+        if len(path) == 0:
+            return
+        import pose_memorizer.library as pomezer_library
+        try:
+            pomezer_library.export_poses(path, ((name, pose_data.to_data())
+                                                for name, pose_data in self.pose_store))
+        except:
+            traceback.print_exc()
+            cmds.warning("{}: Failed to export {}".format(pomezer._name, path))
+        return
+
     def _option_load(self):
         ui_parameter = self.op_file.load()
         if ui_parameter is None:
             return
-        self.mirror_name_combo.setCurrentText(ui_parameter["mirror_name"])
-        self.mirror_axis_combo.setCurrentText(ui_parameter["mirror_axis"])
-        self.mirror_check.setChecked(ui_parameter["mirror"])
-        self.setkey_check.setChecked(ui_parameter["setkey"])
-        self.namespace_check.setChecked(ui_parameter["namespace"])
+        self.mirror_name_combo.setCurrentText(ui_parameter.get("mirror_name", self.MIRRORNAME[0]))
+        self.mirror_axis_combo.setCurrentText(ui_parameter.get("mirror_axis", self.MIRRORAXIS[0]))
+        self.mirror_check.setChecked(ui_parameter.get("mirror", True))
+        self.setkey_check.setChecked(ui_parameter.get("setkey", False))
+        self.namespace_check.setChecked(ui_parameter.get("namespace", True))
+        self.scale_check.setChecked(ui_parameter.get("scale", False))
+        self.user_attr_check.setChecked(ui_parameter.get("user_attr", False))
+        self.blendshape_check.setChecked(ui_parameter.get("blendshape", False))
+        self.preview_check.setChecked(ui_parameter.get("preview", False))
         return
 
     def _option_save(self):
@@ -420,11 +736,13 @@ class PoseMemorizerMainWindow(object):
 
         # Restore
         if restore is True:
+            start = time.time()
             self._make_widget()
             # Restore parent
             mixinPtr = MQtUtil.findControl(self.name)
             wks = MQtUtil.findControl(self.workspace_name)
             MQtUtil.addWidgetToMayaLayout(long(mixinPtr), long(wks))
+            pomezer._report_time("restore", start)
 
         # Create New Workspace
         else:
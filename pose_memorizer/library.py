@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# PoseMemorizer Library (Maya2018-)
+# -----------------------------------------------------------------------------
+# Pose library file
+#   JSON Lines, optionally gzip compressed (*.gz).
+#   1st line : header {"format": "PoseMemorizer", "version": 1}
+#   2nd line-: one pose per line {"name": ..., "pose": Pose.to_data()}
+# Poses are read and written one line at a time, so a library is never
+# loaded into memory as a whole. Filter and merge work on the raw pose
+# data, this module does not need Maya.
+# -----------------------------------------------------------------------------
+
+import io
+import os
+import gzip
+import json
+import tempfile
+
+import pose_memorizer as pomezer
+
+
+# -----------------------------------------------------------------------------
+
+LIBRARY_FORMAT = pomezer._name
+LIBRARY_VERSION = 1
+
+# {file version: function(record) -> record of file version + 1}
+MIGRATIONS = {}
+
+
+# -----------------------------------------------------------------------------
+class PoseLibraryError(Exception):
+    pass
+
+
+# -----------------------------------------------------------------------------
+def _open(path, mode):
+    # Files are opened in binary mode and lines are en/decoded here,
+    # Py2 GzipFile has no read1 and can not be wrapped by io.TextIOWrapper.
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "b")
+    return io.open(path, mode + "b")
+
+
+def _read_line(raw):
+    return json.loads(raw.decode("utf-8"))
+
+
+def _write_line(f, data):
+    f.write((json.dumps(data) + "\n").encode("utf-8"))
+    return
+
+
+def _replace(src, dst):
+    # os.replace is Py3 only, os.rename can not overwrite on Windows
+    if hasattr(os, "replace") is True:
+        os.replace(src, dst)
+        return
+    if os.path.exists(dst) is True:
+        os.remove(dst)
+    os.rename(src, dst)
+    return
+
+
+def _same_path(path_a, path_b):
+    def norm(path):
+        return os.path.normcase(os.path.realpath(os.path.abspath(path)))
+    return norm(path_a) == norm(path_b)
+
+
+def _basename(name):
+    return name.split(":")[-1]
+
+
+def _migrate(record, version):
+    while version < LIBRARY_VERSION:
+        record = MIGRATIONS[version](record)
+        version += 1
+    return record
+
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+class PoseLibraryWriter(object):
+    """Write a library through a temp file next to ``path``.
+
+    ``path`` is only replaced by ``close``, ``abort`` (or an exception in
+    the with block) removes the temp file and leaves ``path`` untouched.
+    """
+
+    def __init__(self, path):
+        super(PoseLibraryWriter, self).__init__()
+        self._path = path
+        suffix = ".tmp.gz" if path.endswith(".gz") else ".tmp"
+        fd, self._temp_path = tempfile.mkstemp(suffix=suffix,
+                                               dir=os.path.dirname(os.path.abspath(path)))
+        os.close(fd)
+        try:
+            self._file = _open(self._temp_path, "w")
+            _write_line(self._file, {"format": LIBRARY_FORMAT, "version": LIBRARY_VERSION})
+        except:
+            self.abort()
+            raise
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return
+
+    def write(self, name, pose_data):
+        _write_line(self._file, {"name": name, "pose": pose_data})
+        return
+
+    def close(self):
+        try:
+            self._file.close()
+            _replace(self._temp_path, self._path)
+        except:
+            self.abort()
+            raise
+        return
+
+    def abort(self):
+        f = getattr(self, "_file", None)
+        if f is not None:
+            f.close()
+        if os.path.exists(self._temp_path) is True:
+            os.remove(self._temp_path)
+        return
+
+
+# -----------------------------------------------------------------------------
+def _make_keep(nodes):
+    return set(_basename(n) for n in nodes)
+
+
+def filter_pose_data(pose_data, nodes):
+    """Cut pose data (Pose.to_data) down to ``nodes``.
+
+    Nodes are matched without namespace. Returns None if no node is left.
+    """
+    return _filter_pose_data(pose_data, _make_keep(nodes))
+
+
+def _filter_pose_data(pose_data, keep):
+    # keep : node basenames
+    src_nodes = pose_data.get("nodes", [])
+    new_index = {}
+    new_nodes = []
+    for i, n in enumerate(src_nodes):
+        if _basename(n) in keep:
+            new_index[i] = len(new_nodes)
+            new_nodes.append(n)
+    if len(new_nodes) == 0:
+        return None
+
+    index = []
+    attrs = []
+    values = []
+    for i, a, v in zip(pose_data.get("index", []), pose_data.get("attrs", []),
+                       pose_data.get("values", [])):
+        j = new_index.get(i)
+        if j is not None:
+            index.append(j)
+            attrs.append(a)
+            values.append(v)
+
+    transform = {n: p for n, p in pose_data.get("transform", {}).items()
+                 if _basename(n) in keep}
+
+    reslut = dict(pose_data)
+    reslut.update({"nodes": new_nodes, "transform": transform,
+                   "index": index, "attrs": attrs, "values": values})
+    return reslut
+
+
+def iter_poses(path, nodes=None):
+    """Yield (name, pose data) from a library file one pose at a time.
+
+    Pose data is the dict of Pose.to_data. If ``nodes`` is given, poses
+    are cut down to those nodes and poses without any of them are skipped.
+    """
+    keep = None if nodes is None else _make_keep(nodes)
+    with _open(path, "r") as f:
+        try:
+            header = _read_line(f.readline() or b"{}")
+        except ValueError:
+            header = {}
+        if isinstance(header, dict) is False or header.get("format") != LIBRARY_FORMAT:
+            raise PoseLibraryError("Not a pose library : {}".format(path))
+        version = header.get("version")
+        if version != LIBRARY_VERSION and version not in MIGRATIONS:
+            raise PoseLibraryError("Unsupported library version {} : {}".format(version, path))
+
+        for line_number, raw in enumerate(f, 2):
+            if len(raw.strip()) == 0:
+                continue
+            try:
+                record = _migrate(_read_line(raw), version)
+                name = record["name"]
+                pose_data = record["pose"]
+                if keep is not None:
+                    pose_data = _filter_pose_data(pose_data, keep)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                raise PoseLibraryError("Broken pose at line {} : {} ({})".format(
+                    line_number, path, e))
+            if pose_data is None:
+                continue
+            yield name, pose_data
+
+
+def export_poses(path, poses, nodes=None):
+    """Write (name, pose data) pairs of ``poses`` (any iterable) to ``path``."""
+    keep = None if nodes is None else _make_keep(nodes)
+    count = 0
+    with PoseLibraryWriter(path) as writer:
+        for name, pose_data in poses:
+            if keep is not None:
+                pose_data = _filter_pose_data(pose_data, keep)
+                if pose_data is None:
+                    continue
+            writer.write(name, pose_data)
+            count += 1
+    return count
+
+
+def merge_libraries(paths, out_path, nodes=None):
+    """Stream the poses of several library files into ``out_path``.
+
+    ``out_path`` must not be one of ``paths``.
+    """
+    paths = list(paths)
+    for path in paths:
+        if _same_path(path, out_path) is True:
+            raise PoseLibraryError("Output is one of the inputs : {}".format(out_path))
+    if nodes is not None:
+        nodes = _make_keep(nodes)
+
+    def iter_all():
+        for path in paths:
+            for name, pose_data in iter_poses(path, nodes):
+                yield name, pose_data
+
+    return export_poses(out_path, iter_all())
+
+
+# -----------------------------------------------------------------------------
+# EOF
+# -----------------------------------------------------------------------------
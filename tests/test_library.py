@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# PoseMemorizer Library test (runs without Maya, Python 2.7 / 3)
+# -----------------------------------------------------------------------------
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from pose_memorizer import library
+
+
+# -----------------------------------------------------------------------------
+def make_pose_data():
+    return {"channels": ["scale", "blendShape"],
+            "nodes": ["chr:head_L", "chr:head_R", "chr:face_bs"],
+            "transform": {"chr:head_L": {"translate": [1.0, 2.0, 3.0],
+                                         "rotate": [0.0, 0.0, 0.0, 1.0]},
+                          "chr:head_R": {"translate": [-1.0, 2.0, 3.0],
+                                         "rotate": [0.0, 0.0, 0.0, 1.0]}},
+            "index": [0, 1, 2, 2],
+            "attrs": ["scaleX", "scaleX", "smile_L", "smile_R"],
+            "values": [1.5, 1.0, 0.25, 0.75]}
+
+
+# -----------------------------------------------------------------------------
+class LibraryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        return
+
+    def _path(self, name):
+        return os.path.join(self.tmp_dir, name)
+
+    def _round_trip(self, name):
+        path = self._path(name)
+        poses = [(u"pose_{}".format(i), make_pose_data()) for i in range(3)]
+        self.assertEqual(library.export_poses(path, iter(poses)), 3)
+        self.assertEqual(list(library.iter_poses(path)), poses)
+        return
+
+    def test_round_trip(self):
+        self._round_trip("poses.jsonl")
+        return
+
+    def test_round_trip_gzip(self):
+        self._round_trip("poses.jsonl.gz")
+        return
+
+    def test_filter(self):
+        path = self._path("poses.jsonl.gz")
+        library.export_poses(path, [(u"a", make_pose_data())])
+        reslut = list(library.iter_poses(path, nodes=["face_bs"]))
+        self.assertEqual(len(reslut), 1)
+        pose_data = reslut[0][1]
+        self.assertEqual(pose_data["nodes"], ["chr:face_bs"])
+        self.assertEqual(pose_data["transform"], {})
+        self.assertEqual(pose_data["index"], [0, 0])
+        self.assertEqual(pose_data["attrs"], ["smile_L", "smile_R"])
+        self.assertEqual(pose_data["values"], [0.25, 0.75])
+        self.assertEqual(list(library.iter_poses(path, nodes=["other"])), [])
+        return
+
+    def test_filter_nodes_generator(self):
+        path = self._path("poses.jsonl")
+        library.export_poses(path, [(u"a", make_pose_data()), (u"b", make_pose_data())])
+        nodes = (n for n in ["head_L"])
+        self.assertEqual([n for n, _ in library.iter_poses(path, nodes=nodes)], [u"a", u"b"])
+        return
+
+    def test_merge(self):
+        src_a = self._path("a.jsonl")
+        src_b = self._path("b.jsonl.gz")
+        out = self._path("out.jsonl")
+        library.export_poses(src_a, [(u"a", make_pose_data())])
+        library.export_poses(src_b, [(u"b", make_pose_data())])
+        self.assertEqual(library.merge_libraries([src_a, src_b], out, nodes=["head_L"]), 2)
+        names = [n for n, _ in library.iter_poses(out)]
+        self.assertEqual(names, [u"a", u"b"])
+        return
+
+    def test_merge_into_input(self):
+        src = self._path("a.jsonl")
+        library.export_poses(src, [(u"a", make_pose_data())])
+        with self.assertRaises(library.PoseLibraryError):
+            library.merge_libraries([src], os.path.join(self.tmp_dir, ".", "a.jsonl"))
+        self.assertEqual([n for n, _ in library.iter_poses(src)], [u"a"])
+        return
+
+    def test_export_failure_keeps_file(self):
+        path = self._path("poses.jsonl.gz")
+        library.export_poses(path, [(u"a", make_pose_data())])
+
+        def broken_poses():
+            yield u"b", make_pose_data()
+            raise RuntimeError("broken")
+
+        with self.assertRaises(RuntimeError):
+            library.export_poses(path, broken_poses())
+        self.assertEqual([n for n, _ in library.iter_poses(path)], [u"a"])
+        self.assertEqual(os.listdir(self.tmp_dir), ["poses.jsonl.gz"])
+        return
+
+    def test_broken_line(self):
+        path = self._path("broken.jsonl")
+        library.export_poses(path, [(u"a", make_pose_data())])
+        with open(path, "a") as f:
+            f.write("{not json\n")
+        reslut = []
+        with self.assertRaises(library.PoseLibraryError) as cm:
+            for name, _ in library.iter_poses(path):
+                reslut.append(name)
+        self.assertEqual(reslut, [u"a"])
+        self.assertIn("line 3", str(cm.exception))
+        return
+
+    def test_missing_key(self):
+        path = self._path("missing.jsonl")
+        with open(path, "w") as f:
+            f.write(json.dumps({"format": library.LIBRARY_FORMAT,
+                                "version": library.LIBRARY_VERSION}) + "\n")
+            f.write(json.dumps({"name": "a"}) + "\n")
+        with self.assertRaises(library.PoseLibraryError):
+            list(library.iter_poses(path))
+        return
+
+    def test_migration(self):
+        path = self._path("old.jsonl")
+        with open(path, "w") as f:
+            f.write(json.dumps({"format": library.LIBRARY_FORMAT, "version": 0}) + "\n")
+            f.write(json.dumps({"title": "old", "data": make_pose_data()}) + "\n")
+
+        def migrate_0(record):
+            return {"name": record["title"], "pose": record["data"]}
+
+        library.MIGRATIONS[0] = migrate_0
+        try:
+            reslut = list(library.iter_poses(path))
+        finally:
+            del library.MIGRATIONS[0]
+        self.assertEqual(reslut, [(u"old", make_pose_data())])
+        with self.assertRaises(library.PoseLibraryError):
+            list(library.iter_poses(path))
+        return
+
+    def test_unsupported_version(self):
+        path = self._path("future.jsonl")
+        with open(path, "w") as f:
+            f.write(json.dumps({"format": library.LIBRARY_FORMAT,
+                                "version": library.LIBRARY_VERSION + 1}) + "\n")
+        with self.assertRaises(library.PoseLibraryError):
+            list(library.iter_poses(path))
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()